@@ -2,19 +2,27 @@
 # -*- coding: utf-8 -*-
 """
 从 TLS.txt + DIY 源（可本地或URL）读取节点，查询国家码并生成 ip-ua.txt / ip-ua.csv
-- 输入支持 "IP:端口" 与 纯 "IP"（自动补 443）
+- 输入支持 "IP:端口"、"[IPv6]:端口" 与 纯 "IP"（纯 IP 探测多个 Cloudflare HTTPS 端口取最快的，探测失败补 443）
 - 为了结果稳定：仅使用 ip-api.com 作为地理库
 - 去重按 IP；若 DIY 指定了端口，优先使用 DIY 端口
+- 国家码与端口探测结果写入与 ip-cf-auto.py 共用的 ip/result_cache.jsonl，有效期内直接复用
 """
 
 import re
 import os
+import ipaddress
 import csv
 import time
+import errno
+import socket
+import selectors
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple, Optional
 
+from node_table import NodeTable, host_port
+from result_cache import ResultCache, probe_key
+
 # ================= 配置 =================
 TLS_FILE = "TLS.txt"                 # CloudflareST 转出来的文件
 # 你的 DIY 源（两者都给时，优先使用 URL，其次本地文件；都缺则跳过DIY）
@@ -30,15 +38,28 @@ TIMEOUT = 5
 RETRIES = 2
 SLEEP_BETWEEN_REQ = 0.05
 
+# 多端口探测：纯 IP 同时探测下列端口（单线程非阻塞并发连接），输出最快的 ip:端口
+MULTI_PORT_PROBE = True
+PROBE_PORTS = [443, 2053, 2083, 2087, 2096, 8443]
+PROBE_COUNT = 2
+PROBE_TIMEOUT = 2.0
+
 # 只用一个提供商，保证结果稳定
 API_URL = "http://ip-api.com/json/{}"
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
 
+# 与 ip-cf-auto.py 共用的结果缓存
+RESULT_CACHE = True
+
 # 正则
 FULL_PATTERN = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3}):(\d+)")
 IP_PATTERN = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+V6_FULL_PATTERN = re.compile(r"\[([0-9A-Fa-f:]+)\]:(\d+)")  # [IPv6]:端口
+V6_PATTERN = re.compile(r"(?<![0-9A-Za-z:.])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}(?![0-9A-Za-z:.])")  # 两侧不能紧接字母数字、冒号或点（排除 ::ffff:1.2.3.4 这类内嵌 IPv4 写法）
 
 # =============== 工具函数 ===============
+_results = ResultCache(enabled=RESULT_CACHE)
+
 def fetch_text(url: str, timeout: int = 10) -> str:
     try:
         r = requests.get(url, headers=HEADERS, timeout=timeout)
@@ -56,11 +77,30 @@ def read_text_file(path: str) -> str:
     except Exception:
         return ""
 
+def valid_port(port: str) -> bool:
+    return port.isdigit() and 0 < int(port) <= 65535
+
+def valid_ipv4(ip: str) -> bool:
+    """正则只保证形如 a.b.c.d；999.1.1.1、带前导零的 8.8.8.08 等交给 ipaddress 判定为非法"""
+    try:
+        ipaddress.IPv4Address(ip)
+    except ValueError:
+        return False
+    return True
+
+def normalize_ipv6(text: str) -> Optional[str]:
+    """校验并规范化 IPv6 地址；非法、非公网地址（bogon）或 IPv4 映射地址返回 None"""
+    try:
+        addr = ipaddress.IPv6Address(text)
+    except ValueError:
+        return None
+    return str(addr) if addr.is_global and addr.ipv4_mapped is None else None
+
 def parse_text_to_items(text: str) -> List[Dict[str, str]]:
     """
     解析任意文本为 [{'ip': ..., 'port': ...}]
     - 允许行内注释，以 # 开头的整行或 'ip #comment' 的注释（处理时截断）
-    - 优先匹配 IP:端口，再补充纯 IP（端口默认 443）
+    - 优先匹配 IP:端口，再补充纯 IP（端口留空，合并后多端口探测或默认 443）
     - 基于 IP 去重（首次出现的端口先记录；后续可在合并阶段做覆盖策略）
     """
     # 去掉行内注释（# 后面的内容），但不影响 # 作为我们最终输出的 “#CC”
@@ -84,13 +124,28 @@ def parse_text_to_items(text: str) -> List[Dict[str, str]]:
     # 先抓 IP:端口
     for ip, port in FULL_PATTERN.findall(text):
         if ip not in seen:
-            items.append({"ip": ip, "port": port})
+            if valid_ipv4(ip) and valid_port(port):  # 地址非法或端口越界的条目整条丢弃
+                items.append({"ip": ip, "port": port})
             seen.add(ip)
 
     # 再抓纯 IP（避免重复）
     for ip in IP_PATTERN.findall(text):
         if ip not in seen:
-            items.append({"ip": ip, "port": "443"})
+            if valid_ipv4(ip):
+                items.append({"ip": ip, "port": ""})
+            seen.add(ip)
+
+    # IPv6：先抓 [地址]:端口，再抓纯地址；统一成压缩写法后去重
+    for ip, port in V6_FULL_PATTERN.findall(text):
+        ip = normalize_ipv6(ip)
+        if ip and ip not in seen:
+            if valid_port(port):
+                items.append({"ip": ip, "port": port})
+            seen.add(ip)
+    for ip in V6_PATTERN.findall(text):
+        ip = normalize_ipv6(ip)
+        if ip and ip not in seen:
+            items.append({"ip": ip, "port": ""})
             seen.add(ip)
 
     return items
@@ -110,9 +165,87 @@ def get_cc_ipapi(ip: str) -> str:
         time.sleep(0.2)
     return "XX"
 
+def multi_port_ping(ip: str, ports: List[int], timeout: float = PROBE_TIMEOUT) -> Dict[int, Optional[float]]:
+    """对同一 IP 的多个端口同时发起非阻塞 TCP 连接，返回 {端口: 延迟ms 或 None}"""
+    results: Dict[int, Optional[float]] = {port: None for port in ports}
+    sel = selectors.DefaultSelector()
+    try:
+        for port in ports:
+            try:
+                sock = socket.socket(socket.AF_INET6 if ":" in ip else socket.AF_INET, socket.SOCK_STREAM)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            start_time = time.time()
+            result = sock.connect_ex((ip, port))
+            if result == 0:
+                results[port] = (time.time() - start_time) * 1000
+                sock.close()
+            elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                sel.register(sock, selectors.EVENT_WRITE, (port, start_time))
+            else:
+                sock.close()
+
+        end_time = time.time() + timeout
+        while sel.get_map():
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                port, start_time = key.data
+                sock = key.fileobj
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    results[port] = (time.time() - start_time) * 1000
+                sel.unregister(sock)
+                sock.close()
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+    return results
+
+def pick_best_port(ip: str, ports: List[int]) -> Optional[int]:
+    """多轮探测后先比成功次数、再比平均延迟，返回最好的端口；全部不通返回 None。
+    有未过期的缓存（[最佳端口, 延迟ms, 丢包率]）时不再探测"""
+    key = probe_key(ip, ports)
+    cached = _results.get("tcp", key)
+    if cached is not None:
+        port, _, loss = cached
+        return port if loss < 100 else None
+
+    latencies: Dict[int, List[float]] = {port: [] for port in ports}
+    for _ in range(PROBE_COUNT):
+        for port, latency in multi_port_ping(ip, ports).items():
+            if latency is not None:
+                latencies[port].append(latency)
+    scored = [(-len(v), sum(v) / len(v), port) for port, v in latencies.items() if v]
+    if not scored:
+        _results.put("tcp", key, [ports[0], 9999.0, 100.0])
+        return None
+    _, latency, port = min(scored)
+    loss = (PROBE_COUNT - len(latencies[port])) / PROBE_COUNT * 100
+    _results.put("tcp", key, [port, round(latency, 1), round(loss, 1)])
+    return port
+
+def batch_best_ports(ips: List[str]) -> Dict[str, int]:
+    """并发为每个 IP 选最好的端口；全部不通的 IP 不在结果中"""
+    results: Dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        fut2ip = {ex.submit(pick_best_port, ip, PROBE_PORTS): ip for ip in ips}
+        for fut in as_completed(fut2ip):
+            try:
+                port = fut.result()
+            except Exception:
+                port = None
+            if port is not None:
+                results[fut2ip[fut]] = port
+    return results
+
 def batch_get_cc(ips: List[str]) -> Dict[str, str]:
-    """并发批量查询"""
-    results: Dict[str, str] = {}
+    """并发批量查询；缓存里有的 IP 不再查询"""
+    results: Dict[str, str] = {ip: _results.get("country", ip) for ip in ips}
+    results = {ip: cc for ip, cc in results.items() if cc}
+    ips = [ip for ip in ips if ip not in results]
     if not ips:
         return results
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
@@ -123,6 +256,8 @@ def batch_get_cc(ips: List[str]) -> Dict[str, str]:
                 results[ip] = fut.result()
             except Exception:
                 results[ip] = "XX"
+            if results[ip] != "XX":
+                _results.put("country", ip, results[ip])
             time.sleep(SLEEP_BETWEEN_REQ)
     return results
 
@@ -190,37 +325,45 @@ def main():
     ips = list(by_ip.keys())
     print(f"🧮 合并后唯一 IP：{len(ips)} 个")
 
+    # 2.5) 未写端口的 IP 多端口探测，取最快的端口
+    no_port_ips = [ip for ip, info in by_ip.items() if not info["port"]]
+    if MULTI_PORT_PROBE and no_port_ips:
+        print(f"🔌 多端口探测 {len(no_port_ips)} 个 IP（{','.join(map(str, PROBE_PORTS))}）...")
+        port_map = batch_best_ports(no_port_ips)
+        for ip, port in port_map.items():
+            by_ip[ip]["port"] = str(port)
+        print(f"✅ {len(port_map)}/{len(no_port_ips)} 个 IP 探测到可用端口")
+
     # 3) 查询国家码
     print(f"🌍 使用 ip-api.com 查询国家码（{len(ips)} 个 IP）...")
     cc_map = batch_get_cc(ips)
 
-    # 4) 生成输出行
-    lines = []
+    # 4) 装入列式节点表（端口只在这里转换一次）
+    table = NodeTable(len(by_ip))
     for ip, info in by_ip.items():
-        port = info.get("port") or "443"
-        cc = cc_map.get(ip, "XX") or "XX"
-        lines.append(f"{ip}:{port}#{cc}")
+        table.append(ip, int(info.get("port") or 443))
+    table.rows["country"] = "XX"
+    table.set_by_ip("country", {ip: cc or "XX" for ip, cc in cc_map.items()})
 
-    # 5) 排序：按国家码，再按整行
-    lines_sorted = sorted(lines, key=lambda x: (x.split("#")[-1], x))
+    # 5) 排序：按国家码，再按 IP、端口
+    nodes = list(table.sort_by("country", "ip", "port"))
 
     # 6) 输出 TXT
     with open(OUTPUT_TXT, "w", encoding="utf-8") as f:
         f.write("# Cloudflare 优选节点 (TLS)\n")
         f.write("# 格式: IP:端口#国家代码\n\n")
-        for line in lines_sorted:
-            f.write(line + "\n")
+        for node in nodes:
+            f.write(f"{host_port(node['ip'], node['port'])}#{node['country']}\n")
 
     # 7) 输出 CSV（ip,port,country）
     with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as csvfile:
         w = csv.writer(csvfile)
         w.writerow(["ip", "port", "country"])
-        for line in lines_sorted:
-            ip, rest = line.split(":", 1)
-            port, cc = rest.split("#", 1)
-            w.writerow([ip, port, cc])
+        for node in nodes:
+            w.writerow([node["ip"], node["port"], node["country"]])
 
-    print(f"🎉 已生成 {OUTPUT_TXT} / {OUTPUT_CSV}（共 {len(lines_sorted)} 条）")
+    print(f"🎉 已生成 {OUTPUT_TXT} / {OUTPUT_CSV}（共 {len(nodes)} 条）")
+    _results.save()
 
 if __name__ == "__main__":
     main()
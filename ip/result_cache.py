@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+探测结果缓存：cf_auto.py / ip-cf-auto.py 共用
+- 只缓存两个作业都会读的结果：按 IP 缓存国家码，按 IP + 端口列表缓存多端口探测选出的最佳端口
+- 一个作业测过的 IP，另一个作业在有效期内直接复用，不再重复查询/探测
+- 文件为一行一条的 JSON（随仓库提交），.gitattributes 对它使用 union 合并，两个作业同时提交也不会冲突；
+  同一条重复出现时取最新的
+- 读写时对缓存文件加 flock（共享读、独占写），本地同时运行多个脚本也不会互相覆盖
+"""
+
+import os
+import json
+import time
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl  # 仅 Unix；Windows 下不加锁
+except ImportError:
+    fcntl = None
+
+CACHE_FILE = "ip/result_cache.jsonl"
+
+# 各类结果的有效期（秒）。main.yml 每 3 小时、cf.yml 每 6 小时运行且同一时刻触发，
+# 一个作业能复用的是另一个作业 3 小时前的结果，有效期要覆盖这 3 小时加上运行耗时和定时延迟
+TTL = {
+    "country": 7 * 24 * 3600,  # 国家码：ip-api.com 结果很少变化
+    "tcp": 4 * 3600,           # 多端口探测，值为 [最佳端口, 延迟ms, 丢包率]
+}
+
+def probe_key(ip: str, ports) -> str:
+    """多端口探测结果的键：同一 IP 在同一组端口上的探测才能互相复用"""
+    return f"{ip}|{'/'.join(map(str, ports))}"
+
+Entry = Tuple[object, float]  # (值, 记录时间)
+
+class ResultCache:
+    """启动时载入一次，运行中线程安全地读写内存，结束时 save() 与文件里的新内容合并后写回"""
+
+    def __init__(self, path: str = CACHE_FILE, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self._entries: Dict[Tuple[str, str], Entry] = self._read() if enabled else {}
+        self._fresh: Dict[Tuple[str, str], Entry] = {}  # 本次新写入的条目
+        self._lock = threading.Lock()
+        self.hits: Counter = Counter()
+
+    def _lock_file(self, f, exclusive: bool) -> None:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    @staticmethod
+    def _parse(lines, now: float) -> Dict[Tuple[str, str], Entry]:
+        entries: Dict[Tuple[str, str], Entry] = {}
+        for line in lines:
+            try:
+                kind, key, value, stamp = json.loads(line)
+            except (ValueError, TypeError):
+                continue  # 坏行（如合并残留）直接忽略
+            if not isinstance(kind, str) or not isinstance(key, str) or kind not in TTL:
+                continue
+            if isinstance(stamp, bool) or not isinstance(stamp, (int, float)) or now - stamp > TTL[kind]:
+                continue
+            if (kind, key) not in entries or entries[(kind, key)][1] < stamp:
+                entries[(kind, key)] = (value, stamp)
+        return entries
+
+    def _read(self) -> Dict[Tuple[str, str], Entry]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                self._lock_file(f, exclusive=False)
+                return self._parse(f, time.time())
+        except OSError:
+            return {}
+
+    def get(self, kind: str, key: str) -> Optional[object]:
+        """未过期的缓存值，没有则返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._fresh.get((kind, key)) or self._entries.get((kind, key))
+        if entry is None or time.time() - entry[1] > TTL[kind]:
+            return None
+        self.hits[kind] += 1
+        return entry[0]
+
+    def put(self, kind: str, key: str, value: object) -> None:
+        if self.enabled:
+            with self._lock:
+                self._fresh[(kind, key)] = (value, time.time())
+
+    def save(self) -> None:
+        """在独占锁内重新读取文件，合并其他进程期间写入的条目，丢弃过期条目后原地写回"""
+        if not self.enabled:
+            return
+        if not self._fresh:
+            if self.hits:
+                print(f"💾 结果缓存：本次命中 {self._hit_summary()}，无新结果")
+                self.hits.clear()
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            fresh = dict(self._fresh)
+        try:
+            with open(self.path, "a+", encoding="utf-8", errors="replace") as f:
+                self._lock_file(f, exclusive=True)
+                f.seek(0)
+                entries = self._parse(f, time.time())
+                for k, entry in fresh.items():
+                    if k not in entries or entries[k][1] < entry[1]:
+                        entries[k] = entry
+                f.seek(0)
+                f.truncate()
+                for (kind, key), (value, stamp) in sorted(entries.items()):
+                    f.write(json.dumps([kind, key, value, round(stamp, 1)], separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"⚠️ 写入结果缓存失败：{e}")
+            return
+        self._entries = entries
+        with self._lock:
+            for k in fresh:
+                if self._fresh.get(k) == fresh[k]:
+                    del self._fresh[k]
+        print(f"💾 结果缓存：本次命中 {self._hit_summary()}，写入 {len(fresh)} 条，共 {len(entries)} 条（{self.path}）")
+        self.hits.clear()
+
+    def _hit_summary(self) -> str:
+        return ", ".join(f"{kind} {n}" for kind, n in sorted(self.hits.items())) or "无"
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地订阅服务：把 ip-ua.csv / ip-no.csv / result.csv 载入内存索引，按需返回过滤后的节点列表
+- GET /ip-ua  /ip-no  /result，参数：country=US,JP  colo=HKG,NRT  port=443,8443  top=10  format=txt|csv
+- txt 格式与 ip-ua.txt 相同（IP:端口#国家代码，IPv6 为 [IP]:端口）
+- 支持 ETag / If-None-Match（304）与 gzip；相同请求直接返回缓存的响应
+- 后台线程监视 CSV 修改时间，文件变化后自动重新载入
+用法：python ip/sub_server.py [端口]
+"""
+
+import os
+import io
+import sys
+import csv
+import gzip
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from node_table import NodeTable, host_port
+
+# ================= 配置 =================
+HOST = "0.0.0.0"
+PORT = 8080
+
+# 订阅名 -> CSV 文件
+SOURCES = {
+    "ip-ua": "ip-ua.csv",
+    "ip-no": "ip-no.csv",
+    "result": "result.csv",   # CloudflareST 原始结果，带 colo（地区码）
+}
+
+RELOAD_INTERVAL = 2.0    # 检查文件变化的间隔（秒）
+CACHE_SIZE = 256         # 缓存的响应数
+MAX_AGE = 60             # Cache-Control max-age（秒）
+
+# =============== 载入 ===============
+def read_csv_rows(path: str) -> List[List[str]]:
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore", newline="") as f:
+            rows = list(csv.reader(f))
+    except Exception:
+        return []
+    return rows[1:]  # 去掉表头
+
+def to_float(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+def load_table(name: str, path: str) -> NodeTable:
+    """按各文件的列格式装入节点表，保持文件原有顺序"""
+    rows = read_csv_rows(path)
+    table = NodeTable(len(rows))
+    for row in rows:
+        try:
+            if name == "result":
+                # IP 地址,已发送,已接收,丢包率,平均延迟,下载速度(MB/s),地区码
+                table.append(row[0], 443, to_float(row[4]), to_float(row[3]) * 100, to_float(row[5]),
+                             colo=row[6] if len(row) > 6 else "")
+            else:
+                # ip,port,country[,latency_ms,packet_loss_percent,download_speed_mbps]
+                table.append(row[0], int(row[1]), *(to_float(v) for v in row[3:6]), country=row[2])
+        except (IndexError, ValueError, OverflowError):
+            continue  # 列缺失、IP 非法或端口超出 0-65535 的行跳过
+    return table
+
+class Index:
+    """一次载入的全部订阅；重新载入时整体替换，请求线程不会看到半新半旧的数据"""
+
+    def __init__(self):
+        self.tables: Dict[str, NodeTable] = {name: load_table(name, path) for name, path in SOURCES.items()}
+        self.version = hashlib.sha1(repr(sorted(file_signature().items())).encode()).hexdigest()[:12]
+        self._join()
+
+    def _join(self):
+        """result.csv 的 colo 补到 ip-ua / ip-no，其余文件的国家码补到 result"""
+        colos: Dict[str, str] = {}
+        result = self.tables["result"]
+        for ip, colo in zip(result.ips(), result.rows["colo"]):
+            if colo:
+                colos[ip] = str(colo)
+        countries: Dict[str, str] = {}
+        for name in ("ip-no", "ip-ua"):
+            table = self.tables[name]
+            table.set_by_ip("colo", colos)
+            for ip, cc in zip(table.ips(), table.rows["country"]):
+                if cc:
+                    countries.setdefault(ip, str(cc))
+        result.set_by_ip("country", countries)
+
+def file_signature() -> Dict[str, Tuple[float, int]]:
+    signature = {}
+    for path in SOURCES.values():
+        try:
+            stat = os.stat(path)
+            signature[path] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            signature[path] = (0.0, 0)
+    return signature
+
+# =============== 查询 ===============
+def split_param(query: Dict[str, List[str]], key: str) -> Optional[List[str]]:
+    values = [v.strip() for raw in query.get(key, []) for v in raw.split(",") if v.strip()]
+    return values or None
+
+def render(table: NodeTable, query: Dict[str, List[str]]) -> Tuple[bytes, str]:
+    countries = split_param(query, "country")
+    colos = split_param(query, "colo")
+    ports = split_param(query, "port")
+    table = table.filter(
+        countries=[c.upper() for c in countries] if countries else None,
+        colos=[c.upper() for c in colos] if colos else None,
+        ports=[int(p) for p in ports if p.isdigit()] if ports else None,
+    )
+    top = split_param(query, "top")
+    if top and top[0].isdigit():
+        table = table.head(int(top[0]))
+
+    if (split_param(query, "format") or ["txt"])[0] == "csv":
+        out = io.StringIO()
+        w = csv.writer(out)
+        w.writerow(["ip", "port", "country", "colo", "latency_ms", "packet_loss_percent", "download_speed_mbps"])
+        for node in table:
+            w.writerow([node["ip"], node["port"], node["country"] or "XX", node["colo"],
+                        *(round(node[k], 2) if node[k] == node[k] else "" for k in
+                          ("latency", "packet_loss", "download_speed"))])
+        return out.getvalue().encode("utf-8"), "text/csv; charset=utf-8"
+
+    lines = [f"{host_port(node['ip'], node['port'])}#{node['country'] or 'XX'}" for node in table]
+    return ("\n".join(lines) + "\n" if lines else "").encode("utf-8"), "text/plain; charset=utf-8"
+
+# =============== 服务 ===============
+_index = Index()
+_cache: "OrderedDict[Tuple, Tuple[bytes, bytes, str, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def cached_response(name: str, query: Dict[str, List[str]]) -> Tuple[bytes, bytes, str, str]:
+    """返回 (原始内容, gzip 内容, Content-Type, ETag)；键里带上索引版本，文件更新后旧缓存自然失效"""
+    index = _index
+    key = (index.version, name, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    body, content_type = render(index.tables[name], query)
+    etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+    entry = (body, gzip.compress(body), content_type, etag)
+    with _cache_lock:
+        _cache[key] = entry
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entry
+
+def accepts_gzip(header: str) -> bool:
+    """按 q 值解析 Accept-Encoding：gzip;q=0 视为拒绝，未写 gzip 时看 * 的 q 值"""
+    qualities: Dict[str, float] = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.strip().lower()] = q
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+def watch_files() -> None:
+    """后台轮询文件修改时间，有变化就重新载入索引并清空缓存"""
+    global _index
+    signature = file_signature()
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        current = file_signature()
+        if current == signature:
+            continue
+        signature = current
+        try:
+            _index = Index()
+            with _cache_lock:
+                _cache.clear()
+            print(f"🔄 已重新载入订阅数据（版本 {_index.version}）")
+        except Exception as e:
+            print(f"⚠️ 重新载入失败，继续使用旧数据：{e}")
+
+class SubscriptionHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = url.path.strip("/").removesuffix(".txt")
+        if name not in SOURCES:
+            self.send_error(404, "unknown subscription")
+            return
+
+        body, gz_body, content_type, etag = cached_response(name, parse_qs(url.query))
+        # 强校验器必须区分内容编码：gzip 版本使用带 -gz 后缀的 ETag
+        use_gzip = accepts_gzip(self.headers.get("Accept-Encoding", ""))
+        if use_gzip:
+            etag = etag[:-1] + '-gz"'
+        if etag in [t.strip().removeprefix("W/") for t in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        payload = gz_body if use_gzip else body
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", f"public, max-age={MAX_AGE}")
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # 高频轮询下不逐条打印访问日志
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    threading.Thread(target=watch_files, daemon=True).start()
+    counts = ", ".join(f"{name} {len(table)} 条" for name, table in _index.tables.items())
+    print(f"🌐 订阅服务已启动：http://{HOST}:{port}/ip-ua（{counts}）")
+    ThreadingHTTPServer((HOST, port), SubscriptionHandler).serve_forever()
+
+if __name__ == "__main__":
+    main()